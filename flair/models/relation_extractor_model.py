@@ -1,12 +1,12 @@
 import logging
 from pathlib import Path
-from typing import List, Optional, Set, Tuple, Union
+from typing import Dict, FrozenSet, Iterator, List, Optional, Set, Tuple, Union
 
 import torch
 
 import flair.embeddings
 import flair.nn
-from flair.data import Relation, Sentence, Span
+from flair.data import Relation, Sentence, Span, Token
 from flair.file_utils import cached_path
 
 log = logging.getLogger("flair")
@@ -50,26 +50,42 @@ class RelationExtractor(flair.nn.DefaultClassifier[Sentence]):
         # whether to use gold entity pairs, and whether to filter entity pairs by type
         self.train_on_gold_pairs_only = train_on_gold_pairs_only
         if entity_pair_filters is not None:
-            self.entity_pair_filters: Optional[Set[Tuple[str, str]]] = set(entity_pair_filters)
+            # normalize to hashable (head, tail) label tuples, e.g. if the filters were given as lists
+            self.entity_pair_filters: Optional[FrozenSet[Tuple[str, str]]] = frozenset(
+                (head_label, tail_label) for head_label, tail_label in entity_pair_filters
+            )
         else:
             self.entity_pair_filters = None
 
+        # allowed tail labels for each head label
+        self._tail_labels_by_head_label: Dict[str, Set[str]] = {}
+        self._tail_labels: Set[str] = set()
+        if self.entity_pair_filters is not None:
+            for head_label, tail_label in self.entity_pair_filters:
+                self._tail_labels_by_head_label.setdefault(head_label, set()).add(tail_label)
+                self._tail_labels.add(tail_label)
+
         self.to(flair.device)
 
     def add_entity_markers(self, sentence, span_1, span_2):
 
         text = ""
 
+        # spans share their Token objects with the sentence, so identity checks suffice; Token.__eq__ would
+        # build two string identifiers for every comparison
+        span_1_first, span_1_last = span_1[0], span_1[-1]
+        span_2_first, span_2_last = span_2[0], span_2[-1]
+
         entity_one_is_first = None
         offset = 0
         for token in sentence:
-            if token == span_2[0]:
+            if token is span_2_first:
                 if entity_one_is_first is None:
                     entity_one_is_first = False
                 offset += 1
                 text += " <e2>"
                 span_2_startid = offset
-            if token == span_1[0]:
+            if token is span_1_first:
                 offset += 1
                 text += " <e1>"
                 if entity_one_is_first is None:
@@ -78,10 +94,10 @@ class RelationExtractor(flair.nn.DefaultClassifier[Sentence]):
 
             text += " " + token.text
 
-            if token == span_1[-1]:
+            if token is span_1_last:
                 offset += 1
                 text += " </e1>"
-            if token == span_2[-1]:
+            if token is span_2_last:
                 offset += 1
                 text += " </e2>"
 
@@ -102,91 +118,153 @@ class RelationExtractor(flair.nn.DefaultClassifier[Sentence]):
             else (expanded_span_2, expanded_span_1),
         )
 
+    def _entity_pair_permutations(self, sentence: Sentence) -> Iterator[Tuple[Span, Span]]:
+        """
+        Yields all ordered pairs of distinct entity spans in the sentence, filtered by entity_pair_filters if set.
+        """
+        entity_label_type = self.entity_label_type
+        entity_pair_filters = self.entity_pair_filters
+        tail_labels_by_head_label = self._tail_labels_by_head_label
+        tail_labels = self._tail_labels
+
+        # look up the label of each entity once, not once per pair
+        entities = [(span, span.get_label(entity_label_type).value) for span in sentence.get_spans(entity_label_type)]
+
+        # a pair needs at least two entities
+        if len(entities) < 2:
+            return
+
+        if entity_pair_filters is None:
+            for head, _ in entities:
+                for tail, _ in entities:
+                    if tail is not head:
+                        yield head, tail
+            return
+
+        # no pair can pass the filters unless some entity may act as head and some entity as tail
+        entity_labels = {label for _, label in entities}
+        if entity_labels.isdisjoint(tail_labels_by_head_label) or entity_labels.isdisjoint(tail_labels):
+            return
+
+        # filter entity pairs according to their tags: collect the allowed tails of each head label once (in
+        # sentence order) and only visit those
+        tails_by_head_label: Dict[str, List[Span]] = {}
+        for head, head_label in entities:
+            if head_label not in tails_by_head_label:
+                allowed_tail_labels = tail_labels_by_head_label.get(head_label, set())
+                tails_by_head_label[head_label] = [span for span, label in entities if label in allowed_tail_labels]
+
+            for tail in tails_by_head_label[head_label]:
+                if tail is not head:
+                    yield head, tail
+
     def forward_pass(
         self,
         sentences: Union[List[Sentence], Sentence],
         for_prediction: bool = False,
     ):
 
-        entity_pairs = []
+        if isinstance(sentences, Sentence):
+            sentences = [sentences]
+
+        # nothing to embed or label for an empty batch
+        if len(sentences) == 0:
+            if for_prediction:
+                return None, [], []
+            return None, []
+
+        label_type = self.label_type
+        train_on_gold_pairs_only = self.train_on_gold_pairs_only
+
+        entity_pairs: List[Tuple[Span, Span]] = []
         labels = []
 
+        # only sentences that contribute at least one entity pair need to be embedded
+        sentences_to_embed = []
+
         for sentence in sentences:
+            gold_relation_labels = sentence.get_labels(label_type)
+
+            # without gold relations (the common case at inference), every entity pair is labeled 'O'
+            if not gold_relation_labels:
+                if train_on_gold_pairs_only:
+                    continue
+                sentence_entity_pairs = list(self._entity_pair_permutations(sentence))
+                entity_pairs.extend(sentence_entity_pairs)
+                labels.extend([["O"] for _ in sentence_entity_pairs])
+                if sentence_entity_pairs:
+                    sentences_to_embed.append(sentence)
+                continue
+
+            number_of_entity_pairs = len(entity_pairs)
 
             # super lame: make dictionary to find relation annotations for a given entity pair
             relation_dict = {}
-            for label in sentence.get_labels(self.label_type):
-                relation_dict[create_position_string(label.data_point.first, label.data_point.second)] = label.value
-
-            # get all entity spans
-            entity_spans = sentence.get_spans(self.entity_label_type)
+            for label in gold_relation_labels:
+                relation_dict[create_position_key(label.data_point.first, label.data_point.second)] = label.value
 
             # go through cross product of entities, for each pair concat embeddings
-            for span_1 in entity_spans:
-                for span_2 in entity_spans:
-                    if span_1 == span_2:
-                        continue
-
-                    # filter entity pairs according to their tags if set
-                    if (
-                        self.entity_pair_filters is not None
-                        and (
-                            span_1.get_label(self.entity_label_type).value,
-                            span_2.get_label(self.entity_label_type).value,
-                        )
-                        not in self.entity_pair_filters
-                    ):
-                        continue
-
-                    position_string = create_position_string(span_1, span_2)
-
-                    # get gold label for this relation (if one exists)
-                    if position_string in relation_dict:
-                        label = relation_dict[position_string]
-
-                    # if there is no gold label for this entity pair, set to 'O' (no relation)
-                    else:
-                        if self.train_on_gold_pairs_only:
-                            continue  # skip 'O' labels if training on gold pairs only
-                        label = "O"
-
-                    labels.append([label])
-
-                    # if predicting, also remember sentences and label candidates
-                    entity_pairs.append(Relation(span_1, span_2))
+            for span_1, span_2 in self._entity_pair_permutations(sentence):
+                position_key = create_position_key(span_1, span_2)
+
+                # get gold label for this relation (if one exists)
+                if position_key in relation_dict:
+                    label = relation_dict[position_key]
+
+                # if there is no gold label for this entity pair, set to 'O' (no relation)
+                else:
+                    if train_on_gold_pairs_only:
+                        continue  # skip 'O' labels if training on gold pairs only
+                    label = "O"
+
+                labels.append([label])
+
+                # remember the entity pair; Relation objects are only created if predicting
+                entity_pairs.append((span_1, span_2))
+
+            if len(entity_pairs) > number_of_entity_pairs:
+                sentences_to_embed.append(sentence)
 
         embedded_entity_pairs = None
 
         # if there's at least one entity pair in the sentence
         if len(entity_pairs) > 0:
 
-            # embed sentences and get embeddings for each entity pair
-            self.embeddings.embed(sentences)
-            relation_embeddings = []
+            # embed all sentences with entity pairs in one call and get embeddings for each entity pair
+            self.embeddings.embed(sentences_to_embed)
 
-            # get embeddings
-            for entity_pair in entity_pairs:
-                span_1 = entity_pair.first
-                span_2 = entity_pair.second
+            # restrict to this model's embeddings, fetching their names once rather than per token lookup
+            embedding_names = self.embeddings.get_names()
 
+            # look up each distinct boundary token once and gather the pair representations from these by index;
+            # entities recur across pairs, and single-token entities have the same first and last token
+            boundary_tokens: List[Token] = []
+            boundary_token_indices: Dict[int, int] = {}
+            pair_token_indices: List[int] = []
+            for span_1, span_2 in entity_pairs:
                 if self.pooling_operation == "first_last":
-                    embedding = torch.cat(
-                        [
-                            span_1.tokens[0].get_embedding(),
-                            span_1.tokens[-1].get_embedding(),
-                            span_2.tokens[0].get_embedding(),
-                            span_2.tokens[-1].get_embedding(),
-                        ]
-                    )
+                    pair_tokens: Tuple[Token, ...] = (span_1[0], span_1[-1], span_2[0], span_2[-1])
                 else:
-                    embedding = torch.cat([span_1.tokens[0].get_embedding(), span_2.tokens[0].get_embedding()])
+                    pair_tokens = (span_1[0], span_2[0])
+
+                for token in pair_tokens:
+                    if id(token) not in boundary_token_indices:
+                        boundary_token_indices[id(token)] = len(boundary_tokens)
+                        boundary_tokens.append(token)
+                    pair_token_indices.append(boundary_token_indices[id(token)])
 
-                relation_embeddings.append(embedding)
+            # a single stack and a gather yield the relation embeddings
+            token_embeddings = torch.stack([token.get_embedding(embedding_names) for token in boundary_tokens])
 
-            embedded_entity_pairs = torch.stack(relation_embeddings)
+            embedded_entity_pairs = torch.index_select(
+                token_embeddings, 0, torch.tensor(pair_token_indices, dtype=torch.long, device=flair.device)
+            ).view(len(entity_pairs), -1)
 
         if for_prediction:
-            return embedded_entity_pairs, labels, entity_pairs
+            # building a Relation formats its identifier and registers it with the sentence, so this is skipped
+            # during training, where only the spans are needed
+            relations = [Relation(span_1, span_2) for span_1, span_2 in entity_pairs]
+            return embedded_entity_pairs, labels, relations
 
         return embedded_entity_pairs, labels
 
@@ -258,3 +336,8 @@ class RelationExtractor(flair.nn.DefaultClassifier[Sentence]):
 
 def create_position_string(head: Span, tail: Span) -> str:
     return f"{head.unlabeled_identifier} -> {tail.unlabeled_identifier}"
+
+
+def create_position_key(head: Span, tail: Span) -> Tuple[int, int, int, int]:
+    # token positions identify a span pair without building and hashing identifier strings
+    return head.tokens[0].idx, head.tokens[-1].idx, tail.tokens[0].idx, tail.tokens[-1].idx
@@ -1,9 +1,12 @@
+from typing import List
+
 import pytest
+import torch
 
 import flair
-from flair.data import Sentence
+from flair.data import Dictionary, Relation, Sentence
 from flair.datasets import ColumnCorpus
-from flair.embeddings import TransformerWordEmbeddings
+from flair.embeddings import TokenEmbeddings, TransformerWordEmbeddings
 from flair.models import RelationExtractor
 from flair.trainers import ModelTrainer
 
@@ -56,3 +59,187 @@ def test_train_load_use_classifier(results_base_path, tasks_base_path):
     assert "founded_by" == sentence.get_labels("relation")[0].value
 
     del loaded_model
+
+
+class PositionEmbeddings(TokenEmbeddings):
+    """Embeds each token as [position, 10 * position], so that relation embeddings can be checked exactly."""
+
+    def __init__(self):
+        self.name = "position"
+        self.static_embeddings = True
+        super().__init__()
+
+    @property
+    def embedding_length(self) -> int:
+        return 2
+
+    def _add_embeddings_internal(self, sentences: List[Sentence]) -> List[Sentence]:
+        for sentence in sentences:
+            for token in sentence:
+                token.set_embedding(self.name, torch.tensor([token.idx, 10.0 * token.idx], device=flair.device))
+        return sentences
+
+
+def _create_relation_extractor(**kwargs) -> RelationExtractor:
+    label_dictionary = Dictionary(add_unk=False)
+    label_dictionary.add_item("O")
+    label_dictionary.add_item("founded_by")
+    label_dictionary.add_item("located_in")
+
+    return RelationExtractor(
+        embeddings=PositionEmbeddings(),
+        label_dictionary=label_dictionary,
+        label_type="relation",
+        entity_label_type="ner",
+        **kwargs,
+    )
+
+
+def _create_sentence() -> Sentence:
+    sentence = Sentence(["Apple", "was", "founded", "by", "Steve", "Jobs", "in", "Cupertino", "."])
+    sentence[0:1].add_label("ner", "ORG")
+    sentence[4:6].add_label("ner", "PER")
+    sentence[7:8].add_label("ner", "LOC")
+    Relation(sentence[4:6], sentence[0:1]).add_label("relation", "founded_by")
+    return sentence
+
+
+def _position_embeddings(*positions: int) -> List[float]:
+    return [value for position in positions for value in (float(position), 10.0 * position)]
+
+
+def test_forward_pass_first_last_pooling():
+    model = _create_relation_extractor()
+    sentence = _create_sentence()
+
+    embedded, labels, relations = model.forward_pass(sentence, for_prediction=True)
+
+    assert [relation.text for relation in relations] == [
+        "Apple -> Steve Jobs",
+        "Apple -> Cupertino",
+        "Steve Jobs -> Apple",
+        "Steve Jobs -> Cupertino",
+        "Cupertino -> Apple",
+        "Cupertino -> Steve Jobs",
+    ]
+    assert labels == [["O"], ["O"], ["founded_by"], ["O"], ["O"], ["O"]]
+
+    # each row concatenates the first and last token of head and tail
+    assert embedded.tolist() == [
+        _position_embeddings(1, 1, 5, 6),
+        _position_embeddings(1, 1, 8, 8),
+        _position_embeddings(5, 6, 1, 1),
+        _position_embeddings(5, 6, 8, 8),
+        _position_embeddings(8, 8, 1, 1),
+        _position_embeddings(8, 8, 5, 6),
+    ]
+
+
+def test_forward_pass_first_pooling():
+    model = _create_relation_extractor(pooling_operation="first")
+    sentence = _create_sentence()
+
+    embedded, labels = model.forward_pass([sentence])
+
+    assert labels == [["O"], ["O"], ["founded_by"], ["O"], ["O"], ["O"]]
+    assert embedded.tolist() == [
+        _position_embeddings(1, 5),
+        _position_embeddings(1, 8),
+        _position_embeddings(5, 1),
+        _position_embeddings(5, 8),
+        _position_embeddings(8, 1),
+        _position_embeddings(8, 5),
+    ]
+
+
+def test_forward_pass_with_entity_pair_filters():
+    # filters may also be given as lists, e.g. when read from a config file
+    model = _create_relation_extractor(entity_pair_filters=[["PER", "ORG"], ["PER", "LOC"], ["ORG", "LOC"]])
+    sentence = _create_sentence()
+
+    embedded, labels, relations = model.forward_pass((sentence,), for_prediction=True)
+
+    # pairs keep the order of the sentence
+    assert [relation.text for relation in relations] == [
+        "Apple -> Cupertino",
+        "Steve Jobs -> Apple",
+        "Steve Jobs -> Cupertino",
+    ]
+    assert labels == [["O"], ["founded_by"], ["O"]]
+    assert embedded.tolist() == [
+        _position_embeddings(1, 1, 8, 8),
+        _position_embeddings(5, 6, 1, 1),
+        _position_embeddings(5, 6, 8, 8),
+    ]
+
+    # no pair passes the filters if the sentence has no head candidate
+    sentence_without_person = Sentence(["Apple", "is", "in", "Cupertino"])
+    sentence_without_person[0:1].add_label("ner", "LOC")
+    sentence_without_person[3:4].add_label("ner", "LOC")
+    embedded, labels = model.forward_pass([sentence_without_person])
+    assert embedded is None
+    assert labels == []
+
+
+def test_forward_pass_train_on_gold_pairs_only():
+    model = _create_relation_extractor(train_on_gold_pairs_only=True)
+    sentence = _create_sentence()
+
+    sentence_without_relations = Sentence(["Steve", "Jobs", "left", "Apple"])
+    sentence_without_relations[0:2].add_label("ner", "PER")
+    sentence_without_relations[3:4].add_label("ner", "ORG")
+
+    embedded, labels, relations = model.forward_pass([sentence_without_relations, sentence], for_prediction=True)
+
+    assert [relation.text for relation in relations] == ["Steve Jobs -> Apple"]
+    assert labels == [["founded_by"]]
+    assert embedded.tolist() == [_position_embeddings(5, 6, 1, 1)]
+
+    # a sentence without gold relations contributes no pairs and is not embedded
+    assert all(token.get_embedding(["position"]).numel() == 0 for token in sentence_without_relations)
+
+
+def test_forward_pass_ignores_other_token_embeddings():
+    model = _create_relation_extractor()
+    sentence = _create_sentence()
+
+    # embeddings left on the tokens by another model must not end up in the relation embeddings
+    for token in sentence:
+        token.set_embedding("other", torch.ones(3, device=flair.device))
+
+    embedded, _ = model.forward_pass([sentence])
+
+    assert embedded.size() == (6, 8)
+    assert embedded[0].tolist() == _position_embeddings(1, 1, 5, 6)
+
+
+def test_forward_pass_empty_batch():
+    model = _create_relation_extractor()
+
+    assert model.forward_pass([]) == (None, [])
+    assert model.forward_pass([], for_prediction=True) == (None, [], [])
+
+
+@pytest.mark.parametrize(
+    "span_1, span_2, tokenized, marker_indices",
+    [
+        # adjacent spans
+        ((0, 2), (2, 3), "<e1> a b </e1> <e2> c </e2> d e", [0, 4]),
+        # overlapping spans
+        ((1, 3), (2, 4), "a <e1> b <e2> c </e1> d </e2> e", [1, 3]),
+        # identical spans
+        ((1, 3), (1, 3), "a <e2> <e1> b c </e1> </e2> d e", [1, 2]),
+        # second span before the first
+        ((3, 5), (0, 1), "<e2> a </e2> b c <e1> d e </e1>", [0, 5]),
+    ],
+)
+def test_add_entity_markers(span_1, span_2, tokenized, marker_indices):
+    model = _create_relation_extractor()
+    sentence = Sentence(["a", "b", "c", "d", "e"])
+
+    expanded_sentence, spans = model.add_entity_markers(
+        sentence, sentence[span_1[0] : span_1[1]], sentence[span_2[0] : span_2[1]]
+    )
+
+    assert expanded_sentence.to_tokenized_string() == tokenized
+    assert [span.tokens[0].idx - 1 for span in spans] == marker_indices